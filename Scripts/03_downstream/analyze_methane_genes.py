@@ -4,32 +4,156 @@ Analyze DIAMOND methane gene search results
 Extract species abundance and functional gene abundance
 """
 
+import numpy as np
 import pandas as pd
+import io
 import sys
 import os
 from collections import Counter
+from functools import lru_cache
+from itertools import islice
+from pathlib import Path
 import re
 
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    CSV_ENGINE = 'pyarrow'
+except ImportError:
+    pa = None
+    CSV_ENGINE = 'c'
+
+# DIAMOND outputs repeat the same read / subject / description many times,
+# so string columns are stored as categoricals. evalue stays float64 because
+# DIAMOND reports values far below the float32 range (e.g. 1e-180), and pident
+# because its per-gene means are exported.
+DIAMOND_DTYPES = {
+    'query_id': 'category',
+    'subject_id': 'category',
+    'pident': 'float64',
+    'length': 'int32',
+    'evalue': 'float64',
+    'bitscore': 'float32',
+    'description': 'category',
+}
+DIAMOND_COLUMNS = list(DIAMOND_DTYPES)
+
+# Alignment details no analysis reads; split off the analysis frame and
+# re-attached only for the rows of the detailed hit export
+RAW_HIT_COLUMNS = ['subject_id', 'evalue', 'bitscore']
+
+# Hit files larger than this are streamed in chunks to bound peak memory;
+# rows per chunk for the C parser, bytes per block for pyarrow's reader
+DIAMOND_STREAM_BYTES = 1 << 30
+DIAMOND_CHUNKSIZE = 1_000_000
+DIAMOND_BLOCK_BYTES = 64 << 20
+
+if pa is not None:
+    DIAMOND_ARROW_TYPES = {
+        col: pa.dictionary(pa.int32(), pa.string()) if dtype == 'category' else pa.from_numpy_dtype(np.dtype(dtype))
+        for col, dtype in DIAMOND_DTYPES.items()
+    }
+
+# Lines of a bbduk stats file searched for the #Total read count
+BBDUK_HEADER_LINES = 20
+
+# Below this many methane hits the pandas groupby beats the numba kernel once
+# importing numba and loading the cached kernel (about 1.4s) is counted
+NUMBA_MIN_HITS = 10_000_000
+
+# Bump when parser output changes so stale Parquet caches are not reused
+PARSE_CACHE_VERSION = 2
+
 def parse_diamond_results(input_file):
     """
     Parse DIAMOND blastx results
     Format: qseqid sseqid pident length evalue bitscore stitle
     """
-    columns = ['query_id', 'subject_id', 'pident', 'length', 'evalue', 'bitscore', 'description']
+    df = pd.read_csv(input_file, sep='\t', names=DIAMOND_COLUMNS, header=None,
+                     dtype=DIAMOND_DTYPES, engine=CSV_ENGINE)
+    
+    return df
+
+# Pattern: protein_name [species_name]
+GENE_INFO_PATTERN = r'^(.+?)\s+\[(.+?)\]'
+
+def _broadcast_categories(values, codes):
+    """Map one value per category back onto rows as a new categorical"""
+    value_codes, uniques = pd.factorize(values, sort=True)
+    row_codes = np.where(codes >= 0, value_codes[codes], -1)
+    return pd.Categorical.from_codes(row_codes, categories=uniques)
+
+# Lowercased categories, keyed by id() of the categories Index they came from
+_lowercase_cache = {}
+LOWERCASE_CACHE_SIZE = 16
+
+def _lowercase_categories(values):
+    """
+    Lowercased categories of a categorical column, computed once per column
+    Frames sliced from the same column share its categories and the cached result
+    """
+    categories = values.cat.categories
+    cached = _lowercase_cache.get(id(categories))
+    if cached is None or cached[0] is not categories:
+        if len(_lowercase_cache) >= LOWERCASE_CACHE_SIZE:
+            _lowercase_cache.clear()
+        cached = (categories, categories.str.lower())
+        _lowercase_cache[id(categories)] = cached
+    return cached[1]
+
+def _ensure_gene_species(df):
+    """
+    Add gene_name and species columns extracted from description
+    The regex only runs on the unique descriptions, not on every hit
+    """
+    if 'gene_name' in df:
+        return df
+    
+    descriptions = df['description'].astype('category')
+    categories = descriptions.cat.categories
+    codes = descriptions.cat.codes.to_numpy()
     
-    df = pd.read_csv(input_file, sep='\t', names=columns, header=None)
+    parts = categories.str.extract(GENE_INFO_PATTERN, expand=True)
+    matched = parts[0].notna().to_numpy()
+    gene_names = np.where(matched, parts[0].str.strip(), categories)
+    species = np.where(matched, parts[1].str.strip(), 'Unknown')
     
+    df['gene_name'] = _broadcast_categories(gene_names, codes)
+    df['species'] = _broadcast_categories(species, codes)
     return df
 
-def extract_gene_info(description):
-    """Extract gene name and species from description"""
-    # Pattern: protein_name [species_name]
-    match = re.match(r'^(.+?)\s+\[(.+?)\]', description)
-    if match:
-        gene_name = match.group(1).strip()
-        species = match.group(2).strip()
-        return gene_name, species
-    return description, "Unknown"
+TAXONOMY_LEVELS = [
+    ('domain', 'd__'), ('phylum', 'p__'), ('class', 'c__'), ('order', 'o__'),
+    ('family', 'f__'), ('genus', 'g__'), ('species', 's__'),
+]
+
+def extract_taxonomy_levels(taxonomy):
+    """
+    Split SingleM taxonomy strings (Root; d__...; s__...) into one column per level
+    Each unique string is split once; missing levels are reported as 'Unknown'
+    """
+    taxonomy = taxonomy.astype('category')
+    categories = taxonomy.cat.categories
+    # Missing taxonomies point one past the last category, at an 'Unknown' slot
+    codes = taxonomy.cat.codes.to_numpy()
+    codes = np.where(codes >= 0, codes, len(categories))
+    
+    parts = categories.to_series(index=range(len(categories)))
+    parts = parts.str.split(';', expand=True).apply(lambda col: col.str.strip())
+    strings = parts.to_numpy(dtype=object)
+    rows = np.arange(len(parts))
+    
+    levels = {}
+    for level, prefix in TAXONOMY_LEVELS:
+        # Keep the last part carrying this rank's prefix
+        ranked = parts.apply(lambda col: col.str.startswith(prefix, na=False)).to_numpy(dtype=bool)
+        last = ranked.shape[1] - 1 - ranked[:, ::-1].argmax(axis=1)
+        values = pd.Series(np.where(ranked.any(axis=1), strings[rows, last], None), dtype=object)
+        values = values.str.replace(prefix, '', regex=False)
+        values = np.append(values.fillna('Unknown').to_numpy(dtype=object), 'Unknown')
+        levels[level] = _broadcast_categories(values, codes)
+    
+    return pd.DataFrame(levels, index=taxonomy.index)
 
 def parse_singlem_otu_table(singlem_file):
     """
@@ -37,40 +161,13 @@ def parse_singlem_otu_table(singlem_file):
     Returns DataFrame with taxonomy and abundance information
     """
     try:
-        df = pd.read_csv(singlem_file, sep='\t')
+        df = pd.read_csv(singlem_file, sep='\t', dtype={'taxonomy': 'category'}, engine=CSV_ENGINE)
         # Extract species-level taxonomy
         df['full_taxonomy'] = df['taxonomy']
         
-        # Parse taxonomy string to extract different levels
-        def extract_taxonomy_levels(tax_string):
-            levels = {'domain': 'Unknown', 'phylum': 'Unknown', 'class': 'Unknown', 
-                     'order': 'Unknown', 'family': 'Unknown', 'genus': 'Unknown', 'species': 'Unknown'}
-            
-            if pd.isna(tax_string) or tax_string == 'Root':
-                return pd.Series(levels)
-            
-            parts = [p.strip() for p in tax_string.split(';')]
-            for part in parts:
-                if part.startswith('d__'):
-                    levels['domain'] = part.replace('d__', '')
-                elif part.startswith('p__'):
-                    levels['phylum'] = part.replace('p__', '')
-                elif part.startswith('c__'):
-                    levels['class'] = part.replace('c__', '')
-                elif part.startswith('o__'):
-                    levels['order'] = part.replace('o__', '')
-                elif part.startswith('f__'):
-                    levels['family'] = part.replace('f__', '')
-                elif part.startswith('g__'):
-                    levels['genus'] = part.replace('g__', '')
-                elif part.startswith('s__'):
-                    levels['species'] = part.replace('s__', '')
-            
-            return pd.Series(levels)
-        
         # Apply taxonomy parsing
-        tax_df = df['taxonomy'].apply(extract_taxonomy_levels)
-        df = pd.concat([df, tax_df], axis=1)
+        tax_df = extract_taxonomy_levels(df['taxonomy'])
+        df[list(tax_df.columns)] = tax_df
         
         return df
     except FileNotFoundError:
@@ -80,258 +177,515 @@ def parse_singlem_otu_table(singlem_file):
         print(f"WARNING: Error parsing SingleM file: {e}")
         return None
 
-def classify_methane_gene(description):
-    """Classify genes into functional categories"""
-    desc_lower = description.lower()
-    
+# Functional categories in priority order: the first matching entry wins.
+# Keywords are lowercase substrings of the lowercased DIAMOND description.
+METHANE_GENE_CATEGORIES = [
     # Methane oxidation (methanotrophs)
-    if any(x in desc_lower for x in ['particulate methane monooxygenase', 'pmoa']):
-        return 'pMMO (Particulate methane monooxygenase)'
-    elif any(x in desc_lower for x in ['soluble methane monooxygenase', 'mmox', 'mmoy', 'mmoz']):
-        return 'sMMO (Soluble methane monooxygenase)'
-    elif 'mmor' in desc_lower:
-        return 'MmoR (MMO regulatory protein)'
-    elif 'mmog' in desc_lower:
-        return 'MmoG (MMO chaperone)'
+    ('pMMO (Particulate methane monooxygenase)', ['particulate methane monooxygenase', 'pmoa']),
+    ('sMMO (Soluble methane monooxygenase)', ['soluble methane monooxygenase', 'mmox', 'mmoy', 'mmoz']),
+    ('MmoR (MMO regulatory protein)', ['mmor']),
+    ('MmoG (MMO chaperone)', ['mmog']),
     
     # Methane production (methanogens)
-    elif any(x in desc_lower for x in ['methyl-coenzyme m reductase', 'mcra', 'mcrb', 'mcrg']):
-        return 'MCR (Methyl-coenzyme M reductase)'
+    ('MCR (Methyl-coenzyme M reductase)', ['methyl-coenzyme m reductase', 'mcra', 'mcrb', 'mcrg']),
     
     # Related metabolism
-    elif 'methanol dehydrogenase' in desc_lower:
-        return 'MDH (Methanol dehydrogenase)'
-    elif 'formaldehyde' in desc_lower:
-        return 'Formaldehyde metabolism'
-    elif 'formate' in desc_lower:
-        return 'Formate metabolism'
+    ('MDH (Methanol dehydrogenase)', ['methanol dehydrogenase']),
+    ('Formaldehyde metabolism', ['formaldehyde']),
+    ('Formate metabolism', ['formate']),
     
     # Supporting enzymes
-    elif any(x in desc_lower for x in ['ammonia', 'ammonium']):
-        return 'Nitrogen metabolism (related)'
+    ('Nitrogen metabolism (related)', ['ammonia', 'ammonium']),
+]
+
+METHANE_GENE_PATTERNS = [
+    (category, re.compile('|'.join(map(re.escape, keywords))))
+    for category, keywords in METHANE_GENE_CATEGORIES
+]
+
+def _ensure_gene_category(df):
+    """
+    Add gene_category column classifying each description
+    Patterns are matched against the unique descriptions only
+    """
+    if 'gene_category' in df:
+        return df
+    
+    descriptions = df['description'].astype('category')
+    categories = _lowercase_categories(descriptions)
+    codes = descriptions.cat.codes.to_numpy()
     
-    return 'Other'
+    labels = np.full(len(categories), 'Other', dtype=object)
+    unassigned = np.ones(len(categories), dtype=bool)
+    for category, pattern in METHANE_GENE_PATTERNS:
+        pending = np.flatnonzero(unassigned)
+        hits = pending[categories[pending].str.contains(pattern)]
+        labels[hits] = category
+        unassigned[hits] = False
+    
+    df['gene_category'] = _broadcast_categories(labels, codes)
+    return df
 
-def analyze_gene_abundance(df):
-    """Analyze functional gene abundance"""
-    print("\n" + "="*80)
-    print("FUNCTIONAL GENE ABUNDANCE ANALYSIS")
-    print("="*80 + "\n")
+def iter_diamond_chunks(input_file, chunksize=DIAMOND_CHUNKSIZE):
+    """
+    Parse DIAMOND results chunk by chunk, as frames with DIAMOND_DTYPES
+    Uses pyarrow's streaming CSV reader when available, else the C parser
+    (chunksize only applies to the C parser; pyarrow reads DIAMOND_BLOCK_BYTES blocks)
+    """
+    if pa is None:
+        with pd.read_csv(input_file, sep='\t', names=DIAMOND_COLUMNS, header=None,
+                         dtype=DIAMOND_DTYPES, chunksize=chunksize) as reader:
+            yield from reader
+        return
+    
+    reader = pa_csv.open_csv(
+        input_file,
+        read_options=pa_csv.ReadOptions(column_names=DIAMOND_COLUMNS, block_size=DIAMOND_BLOCK_BYTES),
+        parse_options=pa_csv.ParseOptions(delimiter='\t'),
+        convert_options=pa_csv.ConvertOptions(column_types=DIAMOND_ARROW_TYPES))
+    for batch in reader:
+        # Dictionary columns come out as categoricals
+        yield batch.to_pandas()
+
+def build_hit_frame(chunks):
+    """
+    Concatenate parsed chunks, accumulating each chunk as it arrives
+    Categorical columns are re-coded against categories shared by all chunks,
+    so only integer codes are kept per chunk and each string is stored once
+    """
+    lookups = {}
+    parts = {col: [] for col in DIAMOND_COLUMNS}
+    for chunk in chunks:
+        for col in DIAMOND_COLUMNS:
+            values = chunk[col]
+            if col not in lookups and not isinstance(values.dtype, pd.CategoricalDtype):
+                parts[col].append(values.to_numpy(DIAMOND_DTYPES[col]))
+                continue
+            lookup = lookups.setdefault(col, {})
+            categories = values.cat.categories
+            # Chunk category -> shared code; the trailing -1 keeps missing values missing
+            remap = np.fromiter((lookup.setdefault(value, len(lookup)) for value in categories),
+                                dtype=np.int32, count=len(categories))
+            parts[col].append(np.append(remap, -1)[values.cat.codes.to_numpy()])
+        del chunk, values
+    
+    columns = {}
+    for col in DIAMOND_COLUMNS:
+        if not parts[col]:
+            columns[col] = pd.Series(dtype=DIAMOND_DTYPES[col])
+            continue
+        data = np.concatenate(parts.pop(col))
+        if col in lookups:
+            # Sorted categories, as a single read_csv would produce
+            categories = np.array(list(lookups.pop(col)), dtype=object)
+            order = np.argsort(categories)
+            rank = np.empty(len(order) + 1, dtype=np.int32)
+            rank[order] = np.arange(len(order), dtype=np.int32)
+            rank[-1] = -1
+            data = pd.Categorical.from_codes(rank[data], categories=categories[order])
+        columns[col] = data
+    return pd.DataFrame(columns)
+
+def load_diamond_hits(input_file):
+    """
+    Parse DIAMOND results with gene_name, species and gene_category derived
+    Large files are streamed; smaller ones are read in one pass
+    Hits are returned sorted by gene_name, then query_id
+    """
+    if os.path.getsize(input_file) > DIAMOND_STREAM_BYTES:
+        df = build_hit_frame(iter_diamond_chunks(input_file))
+    else:
+        df = parse_diamond_results(input_file)
+    _ensure_gene_species(df)
+    _ensure_gene_category(df)
+    
+    # Sort once so every per-gene groupby sees contiguous, already ordered runs
+    return df.sort_values(['gene_name', 'query_id'], kind='mergesort', ignore_index=True)
+
+METHANOTROPH_KEYWORDS = [
+    'methylosinus', 'methylocystis', 'methylomonas', 'methylobacter',
+    'methylococcus', 'methylomicrobium', 'methylocaldum', 'methylocapsa'
+]
+
+METHANOGEN_KEYWORDS = [
+    'methanobacterium', 'methanobrevibacter', 'methanosarcina',
+    'methanococcus', 'methanothermobacter', 'methanospirillum'
+]
+
+METHANOTROPH_PATTERN = re.compile('|'.join(METHANOTROPH_KEYWORDS))
+METHANOGEN_PATTERN = re.compile('|'.join(METHANOGEN_KEYWORDS))
+
+KEY_GENES = {
+    'pmoA': ['pmoa', 'particulate methane monooxygenase'],
+    'mmoX': ['mmox', 'soluble methane monooxygenase'],
+    'mcrA': ['mcra', 'methyl-coenzyme m reductase'],
+    'mxaF': ['mxaf', 'methanol dehydrogenase'],
+}
+
+KEY_GENE_PATTERNS = {
+    gene_key: re.compile('|'.join(keywords))
+    for gene_key, keywords in KEY_GENES.items()
+}
+
+def _category_mask(values, pattern):
+    """
+    Row mask of values whose lowercased text matches pattern
+    Each category is tested only once
+    """
+    values = values.astype('category')
+    hits = np.asarray(_lowercase_categories(values).str.contains(pattern), dtype=bool)
+    codes = values.cat.codes.to_numpy()
+    return np.where(codes >= 0, hits[codes], False)
+
+def _count_unique(values):
+    """
+    Number of distinct values, counted from the codes of a categorical column
+    Filtered frames keep unused categories, so the codes are counted, not the categories
+    """
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        return values.nunique()
+    codes = values.cat.codes.to_numpy()
+    return int(np.count_nonzero(np.bincount(codes[codes >= 0], minlength=len(values.cat.categories))))
+
+class _Report:
+    """Collect report lines and write them to stdout in a single call"""
     
-    # Extract gene info
-    df['gene_name'], df['species'] = zip(*df['description'].apply(extract_gene_info))
-    df['gene_category'] = df['description'].apply(classify_methane_gene)
+    def __init__(self):
+        self._buffer = io.StringIO()
+    
+    def line(self, text=''):
+        self._buffer.write(text)
+        self._buffer.write('\n')
+    
+    def flush(self):
+        sys.stdout.write(self._buffer.getvalue())
+        sys.stdout.flush()
+        self._buffer = io.StringIO()
+
+def analyze_gene_abundance(df):
+    """
+    Analyze functional gene abundance
+    Expects gene_name and gene_category columns (see _ensure_gene_category)
+    """
+    report = _Report()
+    report.line("\n" + "="*80)
+    report.line("FUNCTIONAL GENE ABUNDANCE ANALYSIS")
+    report.line("="*80 + "\n")
     
     # Filter for methane-specific genes
     methane_genes = df[df['gene_category'] != 'Other'].copy()
     
-    print(f"Total DIAMOND hits: {len(df):,}")
-    print(f"Methane-related hits: {len(methane_genes):,}\n")
+    report.line(f"Total DIAMOND hits: {len(df):,}")
+    report.line(f"Methane-related hits: {len(methane_genes):,}\n")
     
     # Gene category abundance (unique reads)
-    print("1. GENE CATEGORY ABUNDANCE (by unique reads)")
-    print("-" * 60)
-    category_counts = methane_genes.groupby('gene_category')['query_id'].nunique()
+    report.line("1. GENE CATEGORY ABUNDANCE (by unique reads)")
+    report.line("-" * 60)
+    # Count each read once per group: de-duplicate pairs, then take group sizes
+    category_reads = methane_genes[['gene_category', 'query_id']].drop_duplicates()
+    category_counts = category_reads.groupby('gene_category', observed=True).size()
     category_counts_sorted = category_counts.sort_values(ascending=False)
+    total_methane_reads = _count_unique(methane_genes['query_id'])
     
     for category, count in category_counts_sorted.items():
-        pct = (count / len(methane_genes['query_id'].unique())) * 100
-        print(f"  {category:<45} {count:>6} reads ({pct:>5.2f}%)")
+        pct = (count / total_methane_reads) * 100
+        report.line(f"  {category:<45} {count:>6} reads ({pct:>5.2f}%)")
     
     # Top genes by read count
-    print("\n2. TOP 20 METHANE-RELATED GENES (by read count)")
-    print("-" * 60)
-    gene_counts = methane_genes.groupby('gene_name')['query_id'].nunique().sort_values(ascending=False).head(20)
+    report.line("\n2. TOP 20 METHANE-RELATED GENES (by read count)")
+    report.line("-" * 60)
+    gene_reads = methane_genes[['gene_name', 'query_id']].drop_duplicates()
+    gene_counts = gene_reads.groupby('gene_name', observed=True, sort=False).size().sort_values(ascending=False).head(20)
     
     for gene, count in gene_counts.items():
-        print(f"  {gene[:60]:<62} {count:>6} reads")
+        report.line(f"  {gene[:60]:<62} {count:>6} reads")
     
     # Gene presence/absence
-    print("\n3. KEY METHANE METABOLISM GENES DETECTED")
-    print("-" * 60)
-    
-    key_genes = {
-        'pmoA': ['pmoa', 'particulate methane monooxygenase'],
-        'mmoX': ['mmox', 'soluble methane monooxygenase'],
-        'mcrA': ['mcra', 'methyl-coenzyme m reductase'],
-        'mxaF': ['mxaf', 'methanol dehydrogenase'],
-    }
+    report.line("\n3. KEY METHANE METABOLISM GENES DETECTED")
+    report.line("-" * 60)
     
-    for gene_key, keywords in key_genes.items():
-        matches = df[df['description'].str.lower().str.contains('|'.join(keywords))]
+    for gene_key, pattern in KEY_GENE_PATTERNS.items():
+        matches = df[_category_mask(df['description'], pattern)]
         if len(matches) > 0:
-            unique_reads = matches['query_id'].nunique()
+            unique_reads = _count_unique(matches['query_id'])
             avg_pident = matches['pident'].mean()
-            print(f"  ✓ {gene_key:<8} Detected: {unique_reads:>5} reads (avg identity: {avg_pident:.1f}%)")
+            report.line(f"  ✓ {gene_key:<8} Detected: {unique_reads:>5} reads (avg identity: {avg_pident:.1f}%)")
         else:
-            print(f"  ✗ {gene_key:<8} Not detected")
+            report.line(f"  ✗ {gene_key:<8} Not detected")
+    
+    report.flush()
     
     return methane_genes
 
 def analyze_species_abundance(df, singlem_df=None):
     """Analyze species/organism abundance using SingleM data if available"""
-    print("\n" + "="*80)
-    print("SPECIES/ORGANISM ABUNDANCE ANALYSIS")
-    print("="*80 + "\n")
+    report = _Report()
+    report.line("\n" + "="*80)
+    report.line("SPECIES/ORGANISM ABUNDANCE ANALYSIS")
+    report.line("="*80 + "\n")
     
     if singlem_df is not None:
-        print("Using SingleM taxonomic classification\n")
+        report.line("Using SingleM taxonomic classification\n")
+        
+        total_hits = singlem_df['num_hits'].sum()
         
         # Aggregate by species
-        species_abundance = singlem_df.groupby('species').agg({
+        species_abundance = singlem_df.groupby('species', observed=True).agg({
             'num_hits': 'sum',
             'coverage': 'sum'
         }).sort_values('num_hits', ascending=False)
         
         # Also get genus-level for unclassified species
-        genus_abundance = singlem_df[singlem_df['species'] == 'Unknown'].groupby('genus').agg({
+        genus_abundance = singlem_df[singlem_df['species'] == 'Unknown'].groupby('genus', observed=True).agg({
             'num_hits': 'sum',
             'coverage': 'sum'
         }).sort_values('num_hits', ascending=False)
         
-        print(f"Total species detected: {len(species_abundance[species_abundance.index != 'Unknown'])}")
-        print(f"Total genera detected: {singlem_df['genus'].nunique()}\n")
-        
-        print("1. TOP 30 SPECIES BY READ ABUNDANCE (from SingleM)")
-        print("-" * 80)
+        report.line(f"Total species detected: {len(species_abundance[species_abundance.index != 'Unknown'])}")
+        report.line(f"Total genera detected: {_count_unique(singlem_df['genus'])}\n")
         
-        total_hits = singlem_df['num_hits'].sum()
+        report.line("1. TOP 30 SPECIES BY READ ABUNDANCE (from SingleM)")
+        report.line("-" * 80)
         
         for i, (species, row) in enumerate(species_abundance.head(30).iterrows(), 1):
             if species != 'Unknown':
                 pct = (row['num_hits'] / total_hits) * 100
-                print(f"  {i:>2}. {species[:60]:<62} {int(row['num_hits']):>6} reads ({pct:>5.2f}%)")
+                report.line(f"  {i:>2}. {species[:60]:<62} {int(row['num_hits']):>6} reads ({pct:>5.2f}%)")
         
         # Show top genera for unclassified species
         if len(genus_abundance) > 0:
-            print("\n   TOP GENERA (species-level unclassified)")
-            print("   " + "-" * 76)
+            report.line("\n   TOP GENERA (species-level unclassified)")
+            report.line("   " + "-" * 76)
             for i, (genus, row) in enumerate(genus_abundance.head(10).iterrows(), 1):
                 if genus != 'Unknown':
                     pct = (row['num_hits'] / total_hits) * 100
-                    print(f"      {genus[:60]:<62} {int(row['num_hits']):>6} reads ({pct:>5.2f}%)")
+                    report.line(f"      {genus[:60]:<62} {int(row['num_hits']):>6} reads ({pct:>5.2f}%)")
         
         species_reads = species_abundance
     else:
-        print("Using DIAMOND protein annotation (less accurate for taxonomy)\n")
+        report.line("Using DIAMOND protein annotation (less accurate for taxonomy)\n")
         
-        # Extract species from DIAMOND results
-        df['gene_name'], df['species'] = zip(*df['description'].apply(extract_gene_info))
+        total_unique_reads = _count_unique(df['query_id'])
         
         # Count unique reads per species
-        species_reads = df.groupby('species')['query_id'].nunique().sort_values(ascending=False)
+        species_reads = df.groupby('species', observed=True)['query_id'].nunique().sort_values(ascending=False)
         
-        print(f"Total species/organisms detected: {len(species_reads)}\n")
+        report.line(f"Total species/organisms detected: {len(species_reads)}\n")
         
-        print("1. TOP 30 SPECIES BY READ ABUNDANCE (from DIAMOND)")
-        print("-" * 80)
-        
-        total_unique_reads = df['query_id'].nunique()
+        report.line("1. TOP 30 SPECIES BY READ ABUNDANCE (from DIAMOND)")
+        report.line("-" * 80)
         
         for i, (species, count) in enumerate(species_reads.head(30).items(), 1):
             pct = (count / total_unique_reads) * 100
-            print(f"  {i:>2}. {species[:60]:<62} {count:>6} reads ({pct:>5.2f}%)")
+            report.line(f"  {i:>2}. {species[:60]:<62} {count:>6} reads ({pct:>5.2f}%)")
     
     # Methanotroph species
-    print("\n2. KNOWN METHANOTROPH SPECIES")
-    print("-" * 80)
-    
-    methanotroph_keywords = [
-        'methylosinus', 'methylocystis', 'methylomonas', 'methylobacter',
-        'methylococcus', 'methylomicrobium', 'methylocaldum', 'methylocapsa'
-    ]
+    report.line("\n2. KNOWN METHANOTROPH SPECIES")
+    report.line("-" * 80)
     
     if singlem_df is not None:
         # Check both species and genus columns
         methanotrophs = singlem_df[
-            singlem_df['species'].str.lower().str.contains('|'.join(methanotroph_keywords), na=False) |
-            singlem_df['genus'].str.lower().str.contains('|'.join(methanotroph_keywords), na=False)
+            _category_mask(singlem_df['species'], METHANOTROPH_PATTERN) |
+            _category_mask(singlem_df['genus'], METHANOTROPH_PATTERN)
         ]
         
         if len(methanotrophs) > 0:
-            methano_abundance = methanotrophs.groupby(['genus', 'species'])['num_hits'].sum().sort_values(ascending=False)
+            methano_abundance = methanotrophs.groupby(['genus', 'species'], observed=True)['num_hits'].sum().sort_values(ascending=False)
             for (genus, species), count in methano_abundance.items():
                 display_name = f"{genus} {species}" if species != 'Unknown' else genus
-                print(f"  ✓ {display_name:<60} {int(count):>6} reads")
+                report.line(f"  ✓ {display_name:<60} {int(count):>6} reads")
         else:
-            print("  No known methanotroph species detected")
+            report.line("  No known methanotroph species detected")
     else:
-        methanotrophs = df[df['species'].str.lower().str.contains('|'.join(methanotroph_keywords), na=False)]
+        methanotrophs = df[_category_mask(df['species'], METHANOTROPH_PATTERN)]
         
         if len(methanotrophs) > 0:
-            methano_species = methanotrophs.groupby('species')['query_id'].nunique().sort_values(ascending=False)
+            methano_species = methanotrophs.groupby('species', observed=True)['query_id'].nunique().sort_values(ascending=False)
             for species, count in methano_species.items():
-                print(f"  ✓ {species:<60} {count:>6} reads")
+                report.line(f"  ✓ {species:<60} {count:>6} reads")
         else:
-            print("  No known methanotroph species detected")
+            report.line("  No known methanotroph species detected")
     
     # Methanogen species
-    print("\n3. KNOWN METHANOGEN SPECIES")
-    print("-" * 80)
-    
-    methanogen_keywords = [
-        'methanobacterium', 'methanobrevibacter', 'methanosarcina',
-        'methanococcus', 'methanothermobacter', 'methanospirillum'
-    ]
+    report.line("\n3. KNOWN METHANOGEN SPECIES")
+    report.line("-" * 80)
     
     if singlem_df is not None:
         methanogens = singlem_df[
-            singlem_df['species'].str.lower().str.contains('|'.join(methanogen_keywords), na=False) |
-            singlem_df['genus'].str.lower().str.contains('|'.join(methanogen_keywords), na=False)
+            _category_mask(singlem_df['species'], METHANOGEN_PATTERN) |
+            _category_mask(singlem_df['genus'], METHANOGEN_PATTERN)
         ]
         
         if len(methanogens) > 0:
-            methano_abundance = methanogens.groupby(['genus', 'species'])['num_hits'].sum().sort_values(ascending=False)
+            methano_abundance = methanogens.groupby(['genus', 'species'], observed=True)['num_hits'].sum().sort_values(ascending=False)
             for (genus, species), count in methano_abundance.items():
                 display_name = f"{genus} {species}" if species != 'Unknown' else genus
-                print(f"  ✓ {display_name:<60} {int(count):>6} reads")
+                report.line(f"  ✓ {display_name:<60} {int(count):>6} reads")
         else:
-            print("  No known methanogen species detected")
+            report.line("  No known methanogen species detected")
     else:
-        methanogens = df[df['species'].str.lower().str.contains('|'.join(methanogen_keywords), na=False)]
+        methanogens = df[_category_mask(df['species'], METHANOGEN_PATTERN)]
         
         if len(methanogens) > 0:
-            methano_species = methanogens.groupby('species')['query_id'].nunique().sort_values(ascending=False)
+            methano_species = methanogens.groupby('species', observed=True)['query_id'].nunique().sort_values(ascending=False)
             for species, count in methano_species.items():
-                print(f"  ✓ {species:<60} {count:>6} reads")
+                report.line(f"  ✓ {species:<60} {count:>6} reads")
         else:
-            print("  No known methanogen species detected")
+            report.line("  No known methanogen species detected")
+    
+    report.flush()
     
     return species_reads
 
+def _scan_sorted_hits(genes, queries, lengths, pidents, n_genes):
+    """
+    Per-gene unique reads, length sum, identity sum and hit count
+    Hits must be sorted by (gene, query) so repeated reads are adjacent
+    Identities are summed with Kahan compensation, as pandas' groupby mean does
+    """
+    read_count = np.zeros(n_genes, dtype=np.int64)
+    length_sum = np.zeros(n_genes, dtype=np.float64)
+    pident_sum = np.zeros(n_genes, dtype=np.float64)
+    pident_error = np.zeros(n_genes, dtype=np.float64)
+    hit_count = np.zeros(n_genes, dtype=np.int64)
+    for i in range(genes.size):
+        gene = genes[i]
+        if i == 0 or gene != genes[i - 1] or queries[i] != queries[i - 1]:
+            read_count[gene] += 1
+        length_sum[gene] += lengths[i]
+        y = pidents[i] - pident_error[gene]
+        t = pident_sum[gene] + y
+        pident_error[gene] = (t - pident_sum[gene]) - y
+        pident_sum[gene] = t
+        hit_count[gene] += 1
+    return read_count, length_sum, pident_sum, hit_count
+
+@lru_cache(maxsize=None)
+def _compiled_scan_sorted_hits():
+    """_scan_sorted_hits compiled with numba, or None when numba is not installed"""
+    try:
+        from numba import njit
+    except ImportError:
+        return None
+    return njit(cache=True)(_scan_sorted_hits)
+
+def _is_sorted_by_codes(genes, queries):
+    """Whether rows are in ascending (gene, query) code order"""
+    gene_steps = np.diff(genes)
+    return bool(np.all((gene_steps > 0) | ((gene_steps == 0) & (np.diff(queries) >= 0))))
+
+def _aggregate_gene_stats(methane_genes):
+    """
+    Unique read count, average alignment length and average identity per gene
+    Large inputs use a single compiled pass over integer codes when numba is available
+    """
+    scan = _compiled_scan_sorted_hits() if len(methane_genes) >= NUMBA_MIN_HITS else None
+    if scan is None:
+        # Unique reads from de-duplicated (gene, read) pairs, averages from all hits
+        gene_reads = methane_genes[['gene_name', 'query_id']].drop_duplicates()
+        read_count = gene_reads.groupby('gene_name', observed=True, sort=False).size().rename('read_count')
+        averages = methane_genes.groupby('gene_name', observed=True, sort=False)[['length', 'pident']].mean()
+        return averages.join(read_count)[['read_count', 'length', 'pident']]
+    
+    gene_names = methane_genes['gene_name'].cat.categories
+    genes = methane_genes['gene_name'].cat.codes.to_numpy(np.int32)
+    queries = methane_genes['query_id'].cat.codes.to_numpy(np.int32)
+    lengths = methane_genes['length'].to_numpy(np.float64)
+    pidents = methane_genes['pident'].to_numpy(np.float64)
+    
+    # load_diamond_hits already sorted the hits; only frames from other
+    # callers that are not in (gene, query) order pay for a sort here
+    if not _is_sorted_by_codes(genes, queries):
+        order = np.lexsort((queries, genes))
+        genes, queries, lengths, pidents = genes[order], queries[order], lengths[order], pidents[order]
+    
+    read_count, length_sum, pident_sum, hit_count = scan(
+        genes, queries, lengths, pidents, len(gene_names))
+    
+    observed = hit_count > 0
+    return pd.DataFrame({
+        'read_count': read_count[observed],
+        'length': length_sum[observed] / hit_count[observed],
+        'pident': pident_sum[observed] / hit_count[observed],
+    }, index=pd.Index(gene_names[observed], name='gene_name'))
+
 def calculate_rpkm(df, total_reads_millions):
-    """Calculate RPKM for genes"""
-    print("\n" + "="*80)
-    print("GENE ABUNDANCE NORMALIZATION (RPKM)")
-    print("="*80 + "\n")
-    
-    df['gene_name'], df['species'] = zip(*df['description'].apply(extract_gene_info))
-    df['gene_category'] = df['description'].apply(classify_methane_gene)
+    """
+    Calculate RPKM for genes
+    Expects gene_name and gene_category columns (see _ensure_gene_category)
+    """
+    report = _Report()
+    report.line("\n" + "="*80)
+    report.line("GENE ABUNDANCE NORMALIZATION (RPKM)")
+    report.line("="*80 + "\n")
     
     methane_genes = df[df['gene_category'] != 'Other'].copy()
     
     # Group by gene name
-    gene_stats = methane_genes.groupby('gene_name').agg({
-        'query_id': 'nunique',  # Unique reads
-        'length': 'mean',        # Average alignment length
-        'pident': 'mean'         # Average identity
-    }).rename(columns={'query_id': 'read_count'})
+    gene_stats = _aggregate_gene_stats(methane_genes)
     
     # Calculate RPKM: (read_count * 1000) / (avg_length * total_reads_millions)
     gene_stats['rpkm'] = (gene_stats['read_count'] * 1000) / (gene_stats['length'] * total_reads_millions)
     gene_stats = gene_stats.sort_values('rpkm', ascending=False)
     
-    print(f"Total reads (millions): {total_reads_millions:.2f}M\n")
-    print("TOP 20 GENES BY RPKM")
-    print("-" * 100)
-    print(f"{'Gene':<50} {'Reads':<10} {'Avg Len':<10} {'Avg ID%':<10} {'RPKM':<10}")
-    print("-" * 100)
+    report.line(f"Total reads (millions): {total_reads_millions:.2f}M\n")
+    report.line("TOP 20 GENES BY RPKM")
+    report.line("-" * 100)
+    report.line(f"{'Gene':<50} {'Reads':<10} {'Avg Len':<10} {'Avg ID%':<10} {'RPKM':<10}")
+    report.line("-" * 100)
     
     for gene, row in gene_stats.head(20).iterrows():
-        print(f"{gene[:48]:<50} {row['read_count']:<10} {row['length']:<10.1f} {row['pident']:<10.1f} {row['rpkm']:<10.4f}")
+        report.line(f"{gene[:48]:<50} {row['read_count']:<10} {row['length']:<10.1f} {row['pident']:<10.1f} {row['rpkm']:<10.4f}")
+    
+    report.flush()
     
     return gene_stats
 
+def _cached_parse(path, parser):
+    """
+    Parse path with parser, memoized in a Parquet file next to the input
+    The cache is keyed by the input's mtime and size, so edits invalidate it
+    Missing inputs go straight to the parser so its own error handling applies
+    """
+    if pa is None or not os.path.exists(path):
+        return parser(path)
+    
+    stat = os.stat(path)
+    cache_file = f"{path}.{parser.__name__}.v{PARSE_CACHE_VERSION}.{stat.st_mtime:.0f}.{stat.st_size}.parquet"
+    if os.path.exists(cache_file):
+        try:
+            return pd.read_parquet(cache_file)
+        except Exception as e:
+            # A damaged cache is a miss: parse again and rewrite it
+            print(f"WARNING: Ignoring unreadable parse cache {cache_file}: {e}")
+    
+    df = parser(path)
+    if df is not None:
+        # Write under a temporary name so an interrupted write never leaves a
+        # truncated file at the cache path
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        try:
+            df.to_parquet(tmp_file, compression='zstd')
+            os.replace(tmp_file, cache_file)
+        except Exception as e:
+            print(f"WARNING: Could not write parse cache {cache_file}: {e}")
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+    return df
+
+def _write_csv(df, path):
+    """
+    Write a large table as CSV without its index
+    Uses pyarrow's multi-threaded writer when available; it quotes strings and
+    writes integral floats without ".0", which pandas reads back the same
+    """
+    if pa is None:
+        df.to_csv(path, index=False)
+        return
+    
+    pa_csv.write_csv(pa.Table.from_pandas(df, preserve_index=False), path)
+
 def main():
     if len(sys.argv) < 3:
         print("Usage: python analyze_methane_genes.py <diamond_results.txt> <singlem_otu_table.csv> [total_reads_millions]")
@@ -342,7 +696,8 @@ def main():
         sys.exit(1)
     
     input_file = sys.argv[1]
-    sample_id = input_file.split('/')[-1].split('_')[0]
+    input_path = Path(input_file)
+    sample_id = input_path.name.split('_', 1)[0]
     singlem_file = sys.argv[2]
     
     # Auto-detect or use provided total reads
@@ -350,12 +705,13 @@ def main():
         total_reads_millions = float(sys.argv[3])
         print(f"Using provided total reads: {total_reads_millions:.2f}M")
     else:
-        # Try to read from bbduk stats
-        base_dir = '/'.join(input_file.split('/')[:-3])
-        bbduk_stats = f"{base_dir}/processed_data/bbduk_cleaned/{sample_id}_bbduk_stats.txt"
-        if os.path.exists(bbduk_stats):
-            with open(bbduk_stats, 'r') as f:
-                for line in f:
+        # Try to read from bbduk stats (<base>/functional_analysis/methane_genes/<hits>)
+        base_dir = Path(*input_path.parts[:-3])
+        bbduk_stats = base_dir / 'processed_data' / 'bbduk_cleaned' / f'{sample_id}_bbduk_stats.txt'
+        try:
+            with bbduk_stats.open('r') as f:
+                # #Total is part of the header block, so only scan the first lines
+                for line in islice(f, BBDUK_HEADER_LINES):
                     if line.startswith('#Total'):
                         total_reads = int(line.split()[1])
                         total_reads_millions = total_reads / 1_000_000
@@ -364,7 +720,7 @@ def main():
                 else:
                     print(f"ERROR: Could not find #Total line in {bbduk_stats}")
                     sys.exit(1)
-        else:
+        except FileNotFoundError:
             print(f"ERROR: BBduk stats file not found: {bbduk_stats}")
             print("Please provide total_reads_millions as third argument")
             sys.exit(1)
@@ -377,23 +733,26 @@ def main():
     print(f"SingleM OTU table: {singlem_file}")
     print("="*80)
     
-    # Parse DIAMOND results
-    df = parse_diamond_results(input_file)
-    
-    # Parse SingleM results
-    singlem_df = parse_singlem_otu_table(singlem_file)
+    # Load SingleM results first: the table is small, and a failure exits
+    # before any DIAMOND parsing starts
+    singlem_df = _cached_parse(singlem_file, parse_singlem_otu_table)
     if singlem_df is None:
         print("ERROR: Failed to load SingleM OTU table")
         sys.exit(1)
     print(f"✓ Loaded {len(singlem_df)} SingleM OTU records\n")
     
-    # Analyze gene abundance
-    methane_genes = analyze_gene_abundance(df)
+    # Parse DIAMOND results (or load them from the Parquet cache); gene name,
+    # species and category are derived once in load_diamond_hits
+    hits = _cached_parse(input_file, load_diamond_hits)
+    export_columns = hits.columns
+    raw_hits = hits[RAW_HIT_COLUMNS]
+    df = hits.drop(columns=RAW_HIT_COLUMNS)
+    del hits
     
-    # Analyze species abundance using SingleM
+    # Run the analyses in this process; they finish faster than the hit
+    # frame could be pickled to worker processes
+    methane_genes = analyze_gene_abundance(df)
     species_reads = analyze_species_abundance(df, singlem_df)
-    
-    # Calculate RPKM
     gene_stats = calculate_rpkm(df, total_reads_millions)
     
     # Set output directory to Results/quick_search
@@ -404,8 +763,10 @@ def main():
     
     # Export detailed tables
     methane_genes_file = f"{output_dir}/{sample_id}_methane_genes_detailed.csv"
-    methane_genes.to_csv(methane_genes_file, index=False)
+    # Re-attach the alignment columns for the methane hits only
+    _write_csv(methane_genes.join(raw_hits)[export_columns], methane_genes_file)
     
+    # The small summary tables keep pandas' CSV format
     species_file = f"{output_dir}/{sample_id}_species_abundance.csv"
     species_reads.to_csv(species_file)
     
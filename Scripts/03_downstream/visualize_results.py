@@ -4,114 +4,253 @@ Visualize methane gene analysis results
 Creates contribution plots and comparative analyses
 """
 
+import argparse
+import heapq
+import io
 import sys
 import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from functools import lru_cache
+from itertools import cycle, islice, repeat
+from operator import itemgetter
 import pandas as pd
+import matplotlib
+from PIL import Image
+
+# Render with cairo when mplcairo is installed, otherwise with Agg; figures are
+# only ever written to files
+try:
+    import mplcairo
+    matplotlib.use('module://mplcairo.base')
+except ImportError:
+    mplcairo = None
+    matplotlib.use('Agg')
+
 import matplotlib.pyplot as plt
 import seaborn as sns
 import numpy as np
 from matplotlib.patches import FancyBboxPatch
 from scipy.spatial import procrustes
 
+try:
+    import pyarrow  # used through pandas' read_csv engine
+    CSV_ENGINE = 'pyarrow'
+except ImportError:
+    CSV_ENGINE = 'c'
+
 # Set style
 sns.set_style("whitegrid")
 plt.rcParams['font.size'] = 10
-plt.rcParams['figure.dpi'] = 300
+plt.rcParams['figure.dpi'] = 100
+
+# Qualitative palettes are fixed color lists, so they are built once and
+# repeated for longer series (as seaborn does)
+SET3_COLORS = sns.color_palette("Set3")
+SET2_COLORS = sns.color_palette("Set2")
+
+# Label columns of the detailed table repeat a handful of values, so they are
+# loaded as categoricals and counted on their integer codes
+DETAILED_DTYPES = {'species': 'category', 'gene_category': 'category'}
+
+DEFAULT_OUTPUT_DIR = "Results/quick_search"
+
+# Output resolution: screen-quality by default, --publication for print
+DEFAULT_DPI = 150
+PUBLICATION_DPI = 300
+
+# The four plots are independent and each is rendered in its own process
+PLOT_WORKERS = min(4, os.cpu_count() or 1)
+
+# In --samples batch mode whole samples are spread over all cores instead
+BATCH_WORKERS = os.cpu_count() or 1
+
+# Procrustes is skipped when fewer than this fraction of SingleM species are
+# also annotated by DIAMOND; the comparison is uninformative for such samples
+PROCRUSTES_MIN_COMMON_FRACTION = 0.05
 
-def plot_gene_category_contribution(detailed_df, sample_id, output_dir):
+# PNG encoding: zlib level 3 is much faster than the default 6 on flat plot
+# colors at a small size cost
+PNG_COMPRESS_LEVEL = 3
+
+# One Figure per process, cleared and resized for every plot instead of
+# building and tearing down a new figure and canvas each time
+_figure = None
+
+def _reusable_figure(figsize):
+    """Return this process's Figure, emptied and reset to the given size"""
+    global _figure
+    if _figure is None:
+        _figure = plt.figure(figsize=figsize)
+        return _figure
+    _figure.clear()
+    _figure.set_dpi(plt.rcParams['figure.dpi'])
+    _figure.set_size_inches(figsize)
+    # tight_layout adjusts the subplot parameters, which clear() keeps
+    _figure.subplots_adjust(**{k: plt.rcParams[f'figure.subplot.{k}']
+                               for k in ('left', 'bottom', 'right', 'top', 'wspace', 'hspace')})
+    return _figure
+
+def save_png(fig, path, dpi):
+    """
+    Render a figure once at the requested resolution and write it as PNG
+    With Agg, the RGBA buffer is encoded by Pillow directly (no Software
+    metadata chunk, but the pHYs resolution is kept so office tools place the
+    figure at its real size); mplcairo figures go through its own savefig
+    """
+    if mplcairo is not None:
+        fig.savefig(path, dpi=dpi)
+        return
+    fig.set_dpi(dpi)
+    fig.canvas.draw()
+    Image.fromarray(np.asarray(fig.canvas.buffer_rgba())).save(
+        path, format='PNG', dpi=(dpi, dpi), compress_level=PNG_COMPRESS_LEVEL, optimize=False)
+
+def _capture_output(func, *args, **kwargs):
+    """Run func in a worker and return (result, text it printed)"""
+    buffer = io.StringIO()
+    with redirect_stdout(buffer):
+        result = func(*args, **kwargs)
+    return result, buffer.getvalue()
+
+def _qualitative_colors(colors, n):
+    """First n colors of a qualitative palette, cycling if n exceeds its size"""
+    return list(islice(cycle(colors), n))
+
+@lru_cache(maxsize=None)
+def _husl_colors(n):
+    """
+    n evenly spaced HUSL colors
+    The hue spacing depends on n, so palettes are cached per size rather than sliced
+    """
+    return sns.color_palette("husl", n)
+
+def _value_counter(values):
+    """
+    Counter of the non-null values of a column, in order of first appearance
+    Categorical columns are counted from their codes
+    """
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        return Counter(values.dropna().to_numpy())
+    codes = values.cat.codes.to_numpy()
+    codes, first, counts = np.unique(codes[codes >= 0], return_index=True, return_counts=True)
+    order = np.argsort(first, kind='stable')
+    return Counter(dict(zip(values.cat.categories[codes[order]], counts[order].tolist())))
+
+def _top_n_rows(df, column, n):
+    """
+    Rows with the n largest values of a column, in descending order
+    Same result as df.nlargest(n, column), but selected with an O(N) partition
+    instead of a full sort; ties keep the earlier row
+    """
+    values = df[column].to_numpy()
+    missing = np.isnan(values)
+    positions = np.flatnonzero(~missing)
+    if n < len(positions):
+        # n-th largest value, then everything above it plus the first ties
+        kth = np.partition(values[positions], len(positions) - n)[len(positions) - n]
+        above = positions[values[positions] > kth]
+        ties = positions[values[positions] == kth][:n - len(above)]
+        positions = np.concatenate([above, ties])
+    positions = positions[np.argsort(-values[positions], kind='stable')]
+    if n > len(positions):
+        # Like nlargest, missing values only fill up a short column
+        positions = np.concatenate([positions, np.flatnonzero(missing)])[:n]
+    return df.iloc[positions]
+
+def plot_gene_category_contribution(category_counts, n_reads, sample_id, output_dir, dpi=DEFAULT_DPI):
     """Plot stacked bar chart of gene category contributions"""
     
-    # Count reads per gene category
-    category_counts = detailed_df['gene_category'].value_counts()
+    # Order categories by read count
+    category_counts = dict(sorted(category_counts.items(), key=itemgetter(1), reverse=True))
     
     # Create figure
-    fig, ax = plt.subplots(figsize=(10, 6))
+    fig = _reusable_figure((10, 6))
+    ax = fig.add_subplot()
     
     # Color palette
-    colors = sns.color_palette("husl", len(category_counts))
-    
-    # Create horizontal stacked bar
-    left = 0
-    for i, (category, count) in enumerate(category_counts.items()):
-        percentage = (count / len(detailed_df)) * 100
-        ax.barh(0, count, left=left, height=0.5, 
-                label=f'{category} ({percentage:.1f}%)', 
-                color=colors[i], edgecolor='white', linewidth=2)
-        
-        # Add count label in the middle of the bar
-        if percentage > 5:  # Only show label if segment is large enough
-            ax.text(left + count/2, 0, f'{count}', 
-                   ha='center', va='center', fontweight='bold', fontsize=9)
-        
-        left += count
-    
-    ax.set_xlim(0, len(detailed_df))
+    colors = _husl_colors(len(category_counts))
+    
+    # Create horizontal stacked bar (one barh call for all segments)
+    counts = np.fromiter(category_counts.values(), dtype=np.int64, count=len(category_counts))
+    lefts = counts.cumsum() - counts
+    percentages = (counts / n_reads) * 100
+    bars = ax.barh(np.zeros(len(counts)), counts, left=lefts, height=0.5,
+                   color=colors, edgecolor='white', linewidth=2)
+    labels = [f'{category} ({percentage:.1f}%)'
+              for category, percentage in zip(category_counts, percentages)]
+    
+    # Add count label in the middle of the bar (only if segment is large enough)
+    ax.bar_label(bars, labels=[f'{count}' if percentage > 5 else ''
+                               for count, percentage in zip(counts, percentages)],
+                 label_type='center', fontweight='bold', fontsize=9)
+    
+    ax.set_xlim(0, n_reads)
     ax.set_ylim(-0.5, 0.5)
     ax.set_xlabel('Number of Reads', fontsize=12, fontweight='bold')
     ax.set_title(f'Gene Category Contribution - Sample {sample_id}', 
                 fontsize=14, fontweight='bold', pad=20)
     ax.set_yticks([])
-    ax.legend(loc='center left', bbox_to_anchor=(1, 0.5), frameon=True, fontsize=10)
+    ax.legend(bars, labels, loc='center left', bbox_to_anchor=(1, 0.5), frameon=True, fontsize=10)
     ax.grid(axis='x', alpha=0.3)
     
-    plt.tight_layout()
-    plt.savefig(f'{output_dir}/{sample_id}_gene_category_contribution.png', 
-                bbox_inches='tight', dpi=300)
-    plt.close()
+    fig.tight_layout()
+    save_png(fig, f'{output_dir}/{sample_id}_gene_category_contribution.png', dpi)
     
     print(f"✓ Created: {sample_id}_gene_category_contribution.png")
 
 
-def plot_species_contribution(species_df, detailed_df, sample_id, output_dir, top_n=15):
+def plot_species_contribution(species_df, species_counts, n_reads, sample_id, output_dir, top_n=15,
+                              dpi=DEFAULT_DPI):
     """Plot stacked bar chart of top species contributions to methane genes"""
     
     # Get species from detailed genes (from DIAMOND annotations)
-    diamond_species = detailed_df['species'].value_counts().head(top_n)
+    diamond_species = dict(heapq.nlargest(top_n, species_counts.items(), key=itemgetter(1)))
     
     # Get species from SingleM (actual taxonomy)
-    singlem_species = species_df.nlargest(top_n, 'num_hits')
+    singlem_species = _top_n_rows(species_df, 'num_hits', top_n)
     
     # Create figure with two subplots
-    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(16, 8))
+    fig = _reusable_figure((16, 8))
+    ax1, ax2 = fig.subplots(1, 2)
     
     # Plot 1: DIAMOND annotations (gene-associated species)
-    colors1 = sns.color_palette("Set3", len(diamond_species))
-    left = 0
-    for i, (species, count) in enumerate(diamond_species.items()):
-        percentage = (count / len(detailed_df)) * 100
-        ax1.barh(0, count, left=left, height=0.6,
-                label=f'{species[:30]}... ({percentage:.1f}%)', 
-                color=colors1[i], edgecolor='white', linewidth=1.5)
-        if percentage > 3:
-            ax1.text(left + count/2, 0, f'{count}', 
-                    ha='center', va='center', fontsize=8, fontweight='bold')
-        left += count
-    
-    ax1.set_xlim(0, len(detailed_df))
+    colors1 = _qualitative_colors(SET3_COLORS, len(diamond_species))
+    counts1 = np.fromiter(diamond_species.values(), dtype=np.int64, count=len(diamond_species))
+    lefts1 = counts1.cumsum() - counts1
+    percentages1 = (counts1 / n_reads) * 100
+    bars1 = ax1.barh(np.zeros(len(counts1)), counts1, left=lefts1, height=0.6,
+                     color=colors1, edgecolor='white', linewidth=1.5)
+    labels1 = [f'{species[:30]}... ({percentage:.1f}%)'
+               for species, percentage in zip(diamond_species, percentages1)]
+    ax1.bar_label(bars1, labels=[f'{count}' if percentage > 3 else ''
+                                 for count, percentage in zip(counts1, percentages1)],
+                  label_type='center', fontsize=8, fontweight='bold')
+    
+    ax1.set_xlim(0, n_reads)
     ax1.set_ylim(-0.5, 0.5)
     ax1.set_xlabel('Number of Gene Hits', fontsize=11, fontweight='bold')
     ax1.set_title('DIAMOND Gene Annotations\n(Species from methane gene hits)', 
                  fontsize=12, fontweight='bold', pad=15)
     ax1.set_yticks([])
-    ax1.legend(loc='upper center', bbox_to_anchor=(0.5, -0.1), 
+    ax1.legend(bars1, labels1, loc='upper center', bbox_to_anchor=(0.5, -0.1), 
               ncol=2, frameon=True, fontsize=8)
     ax1.grid(axis='x', alpha=0.3)
     
     # Plot 2: SingleM taxonomy (actual community composition)
-    colors2 = sns.color_palette("Set2", len(singlem_species))
-    left = 0
-    total_hits = singlem_species['num_hits'].sum()
-    for i, (idx, row) in enumerate(singlem_species.iterrows()):
-        species = row['species']
-        count = row['num_hits']
-        percentage = (count / total_hits) * 100
-        ax2.barh(0, count, left=left, height=0.6,
-                label=f'{species[:30]}... ({percentage:.1f}%)', 
-                color=colors2[i], edgecolor='white', linewidth=1.5)
-        if percentage > 3:
-            ax2.text(left + count/2, 0, f'{count}', 
-                    ha='center', va='center', fontsize=8, fontweight='bold')
-        left += count
+    colors2 = _qualitative_colors(SET2_COLORS, len(singlem_species))
+    counts2 = singlem_species['num_hits'].to_numpy()
+    lefts2 = counts2.cumsum() - counts2
+    total_hits = counts2.sum()
+    percentages2 = (counts2 / total_hits) * 100
+    bars2 = ax2.barh(np.zeros(len(counts2)), counts2, left=lefts2, height=0.6,
+                     color=colors2, edgecolor='white', linewidth=1.5)
+    labels2 = [f'{species[:30]}... ({percentage:.1f}%)'
+               for species, percentage in zip(singlem_species['species'], percentages2)]
+    ax2.bar_label(bars2, labels=[f'{count}' if percentage > 3 else ''
+                                 for count, percentage in zip(counts2, percentages2)],
+                  label_type='center', fontsize=8, fontweight='bold')
     
     ax2.set_xlim(0, total_hits)
     ax2.set_ylim(-0.5, 0.5)
@@ -119,56 +258,63 @@ def plot_species_contribution(species_df, detailed_df, sample_id, output_dir, to
     ax2.set_title('SingleM Taxonomy\n(Actual community composition)', 
                  fontsize=12, fontweight='bold', pad=15)
     ax2.set_yticks([])
-    ax2.legend(loc='upper center', bbox_to_anchor=(0.5, -0.1), 
+    ax2.legend(bars2, labels2, loc='upper center', bbox_to_anchor=(0.5, -0.1), 
               ncol=2, frameon=True, fontsize=8)
     ax2.grid(axis='x', alpha=0.3)
     
-    plt.suptitle(f'Species Contribution Comparison - Sample {sample_id}', 
-                fontsize=14, fontweight='bold', y=1.02)
-    plt.tight_layout()
-    plt.savefig(f'{output_dir}/{sample_id}_species_contribution.png', 
-                bbox_inches='tight', dpi=300)
-    plt.close()
+    fig.suptitle(f'Species Contribution Comparison - Sample {sample_id}', 
+                fontsize=14, fontweight='bold')
+    fig.tight_layout()
+    save_png(fig, f'{output_dir}/{sample_id}_species_contribution.png', dpi)
     
     print(f"✓ Created: {sample_id}_species_contribution.png")
 
 
-def plot_procrustes_analysis(species_df, detailed_df, sample_id, output_dir):
+def match_common_species(species_df, species_counts):
     """
-    Procrustes analysis comparing DIAMOND vs SingleM species profiles
-    Note: For single sample, shows composition comparison
+    Species found by both DIAMOND and SingleM, with their abundance in each
+    Returns (sorted species names, DIAMOND read counts, SingleM hit counts)
     """
     
     # Get species abundance from both methods
-    diamond_species = detailed_df['species'].value_counts()
+    diamond_species = species_counts
     singlem_species = species_df.set_index('species')['num_hits']
     
-    # Get common species
-    common_species = list(set(diamond_species.index) & set(singlem_species.index))
+    # Get common species (sorted, with their positions in both profiles)
+    diamond_names = np.array(list(diamond_species), dtype=str)
+    diamond_counts = np.fromiter(diamond_species.values(), dtype=np.int64, count=len(diamond_species))
+    common_species, diamond_idx, singlem_idx = np.intersect1d(
+        diamond_names, singlem_species.index.to_numpy(dtype=str), return_indices=True)
+    
+    return common_species, diamond_counts[diamond_idx], singlem_species.to_numpy()[singlem_idx]
+
+
+def plot_procrustes_analysis(common_species, diamond_abund, singlem_abund, sample_id, output_dir,
+                             dpi=DEFAULT_DPI):
+    """
+    Procrustes analysis comparing DIAMOND vs SingleM species profiles
+    Note: For single sample, shows composition comparison
+    Takes the output of match_common_species
+    """
     
     if len(common_species) < 3:
         print(f"⚠ Warning: Only {len(common_species)} common species found. Skipping Procrustes analysis.")
         print("   Procrustes analysis requires at least 3 common species for meaningful comparison.")
         return
     
-    # Create abundance matrix for common species
-    diamond_abund = np.array([diamond_species.get(sp, 0) for sp in common_species])
-    singlem_abund = np.array([singlem_species.get(sp, 0) for sp in common_species])
-    
     # Normalize
-    diamond_abund = diamond_abund / diamond_abund.sum()
-    singlem_abund = singlem_abund / singlem_abund.sum()
-    
-    # Create 2D coordinates for visualization (using log abundance and rank)
-    diamond_coords = np.column_stack([
-        np.log10(diamond_abund + 1e-10),
-        np.arange(len(common_species))
-    ])
-    
-    singlem_coords = np.column_stack([
-        np.log10(singlem_abund + 1e-10),
-        np.arange(len(common_species))
-    ])
+    diamond_abund = diamond_abund * (1.0 / diamond_abund.sum())
+    singlem_abund = singlem_abund * (1.0 / singlem_abund.sum())
+    
+    # Create 2D coordinates for visualization (using log abundance and rank),
+    # filled in place in one preallocated array per method
+    n_common = len(common_species)
+    diamond_coords = np.empty((n_common, 2))
+    singlem_coords = np.empty((n_common, 2))
+    for coords, abund in ((diamond_coords, diamond_abund), (singlem_coords, singlem_abund)):
+        np.add(abund, 1e-10, out=coords[:, 0])
+        np.log10(coords[:, 0], out=coords[:, 0])
+        coords[:, 1] = np.arange(n_common)
     
     # Perform Procrustes analysis
     mtx1, mtx2, disparity = procrustes(diamond_coords, singlem_coords)
@@ -177,7 +323,8 @@ def plot_procrustes_analysis(species_df, detailed_df, sample_id, output_dir):
     correlation = np.corrcoef(diamond_abund, singlem_abund)[0, 1]
     
     # Create figure
-    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 6))
+    fig = _reusable_figure((14, 6))
+    ax1, ax2 = fig.subplots(1, 2)
     
     # Plot 1: Procrustes superimposition
     ax1.scatter(mtx1[:, 0], mtx1[:, 1], c='blue', s=100, alpha=0.6, 
@@ -185,12 +332,9 @@ def plot_procrustes_analysis(species_df, detailed_df, sample_id, output_dir):
     ax1.scatter(mtx2[:, 0], mtx2[:, 1], c='red', s=100, alpha=0.6, 
                label='SingleM', edgecolors='black', linewidth=1)
     
-    # Draw arrows connecting corresponding points
-    for i in range(len(mtx1)):
-        ax1.arrow(mtx1[i, 0], mtx1[i, 1], 
-                 mtx2[i, 0] - mtx1[i, 0], mtx2[i, 1] - mtx1[i, 1],
-                 alpha=0.3, head_width=0.05, head_length=0.05, 
-                 fc='gray', ec='gray', linestyle='--', linewidth=0.5)
+    # Draw arrows connecting corresponding points (one quiver collection)
+    ax1.quiver(mtx1[:, 0], mtx1[:, 1], mtx2[:, 0] - mtx1[:, 0], mtx2[:, 1] - mtx1[:, 1],
+               angles='xy', scale_units='xy', scale=1, color='gray', alpha=0.3, width=0.003)
     
     ax1.set_xlabel('Dimension 1 (log abundance)', fontsize=11, fontweight='bold')
     ax1.set_ylabel('Dimension 2 (rank)', fontsize=11, fontweight='bold')
@@ -214,12 +358,20 @@ def plot_procrustes_analysis(species_df, detailed_df, sample_id, output_dir):
     max_val = max(diamond_abund.max(), singlem_abund.max())
     ax2.plot([0, max_val], [0, max_val], 'k--', alpha=0.5, label='1:1 line')
     
-    # Add regression line
-    z = np.polyfit(diamond_abund, singlem_abund, 1)
-    p = np.poly1d(z)
-    x_line = np.linspace(0, max_val, 100)
-    ax2.plot(x_line, p(x_line), 'r-', alpha=0.7, linewidth=2, 
-            label=f'Fit: y={z[0]:.2f}x+{z[1]:.2e}')
+    # Add regression line (closed-form least squares for a degree-1 fit)
+    x_mean = diamond_abund.mean()
+    y_mean = singlem_abund.mean()
+    if np.ptp(diamond_abund) > 4 * np.finfo(float).eps * np.abs(diamond_abund).max():
+        dx = diamond_abund - x_mean
+        slope = np.dot(dx, singlem_abund - y_mean) / np.dot(dx, dx)
+        intercept = y_mean - slope * x_mean
+    else:
+        # All DIAMOND abundances are equal (e.g. one read per species), so the
+        # closed form divides by zero; polyfit returns its minimum-norm line
+        slope, intercept = np.polyfit(diamond_abund, singlem_abund, 1)
+    x_line = np.array([0, max_val])
+    ax2.plot(x_line, slope * x_line + intercept, 'r-', alpha=0.7, linewidth=2, 
+            label=f'Fit: y={slope:.2f}x+{intercept:.2e}')
     
     ax2.set_xlabel('DIAMOND Relative Abundance', fontsize=11, fontweight='bold')
     ax2.set_ylabel('SingleM Relative Abundance', fontsize=11, fontweight='bold')
@@ -228,12 +380,10 @@ def plot_procrustes_analysis(species_df, detailed_df, sample_id, output_dir):
     ax2.legend(fontsize=9, frameon=True)
     ax2.grid(alpha=0.3)
     
-    plt.suptitle(f'Method Comparison: DIAMOND vs SingleM - Sample {sample_id}', 
-                fontsize=14, fontweight='bold', y=1.02)
-    plt.tight_layout()
-    plt.savefig(f'{output_dir}/{sample_id}_procrustes_analysis.png', 
-                bbox_inches='tight', dpi=300)
-    plt.close()
+    fig.suptitle(f'Method Comparison: DIAMOND vs SingleM - Sample {sample_id}', 
+                fontsize=14, fontweight='bold')
+    fig.tight_layout()
+    save_png(fig, f'{output_dir}/{sample_id}_procrustes_analysis.png', dpi)
     
     print(f"✓ Created: {sample_id}_procrustes_analysis.png")
     print(f"  Procrustes disparity (M²): {disparity:.4f} (lower is better)")
@@ -241,20 +391,25 @@ def plot_procrustes_analysis(species_df, detailed_df, sample_id, output_dir):
     print(f"  Common species analyzed: {len(common_species)}")
 
 
-def plot_gene_rpkm_heatmap(rpkm_df, sample_id, output_dir, top_n=20):
+def plot_gene_rpkm_heatmap(rpkm_df, sample_id, output_dir, top_n=20, dpi=DEFAULT_DPI):
     """Plot heatmap of top genes by RPKM"""
     
-    top_genes = rpkm_df.nlargest(top_n, 'rpkm')
+    top_genes = _top_n_rows(rpkm_df, 'rpkm', top_n)
     
     # Create data for heatmap
-    data = top_genes[['read_count', 'length', 'pident', 'rpkm']].T
-    data.columns = [idx[:40] + '...' if len(idx) > 40 else idx 
-                    for idx in top_genes.index]
+    metrics = ['read_count', 'length', 'pident', 'rpkm']
+    data = top_genes[metrics].to_numpy(dtype=float, copy=True).T
+    names = top_genes.index.to_series()
+    labels = names.str.slice(0, 40)
+    labels = labels.mask(names.str.len() > 40, labels + '...')
     
     # Normalize each row for better visualization
-    data_norm = data.div(data.max(axis=1), axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        data /= data.max(axis=1, keepdims=True)
+    data_norm = pd.DataFrame(data, index=metrics, columns=labels.to_numpy())
     
-    fig, ax = plt.subplots(figsize=(14, 6))
+    fig = _reusable_figure((14, 6))
+    ax = fig.add_subplot()
     sns.heatmap(data_norm, annot=False, cmap='YlOrRd', 
                 cbar_kws={'label': 'Normalized Value'}, 
                 linewidths=0.5, linecolor='white', ax=ax)
@@ -266,36 +421,58 @@ def plot_gene_rpkm_heatmap(rpkm_df, sample_id, output_dir, top_n=20):
     ax.set_yticklabels(['Read Count', 'Avg Length', 'Avg Identity%', 'RPKM'], 
                        rotation=0)
     
-    plt.tight_layout()
-    plt.savefig(f'{output_dir}/{sample_id}_gene_rpkm_heatmap.png', 
-                bbox_inches='tight', dpi=300)
-    plt.close()
+    fig.tight_layout()
+    save_png(fig, f'{output_dir}/{sample_id}_gene_rpkm_heatmap.png', dpi)
     
     print(f"✓ Created: {sample_id}_gene_rpkm_heatmap.png")
 
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python visualize_results.py <sample_id> [output_dir]")
-        print("\nExample:")
-        print("  python visualize_results.py 53394")
-        print("  python visualize_results.py 53394 Results/quick_search")
-        sys.exit(1)
-    
-    sample_id = sys.argv[1]
-    
-    # Determine output directory
-    if len(sys.argv) > 2:
-        output_dir = sys.argv[2]
-    else:
-        # Auto-detect from quick_search results
-        output_dir = "Results/quick_search"
-    
-    # Check if output directory exists
-    if not os.path.exists(output_dir):
-        print(f"ERROR: Output directory not found: {output_dir}")
-        sys.exit(1)
-    
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Visualize methane gene analysis results",
+        epilog="Example:\n"
+               "  python visualize_results.py 53394\n"
+               "  python visualize_results.py 53394 Results/quick_search --publication\n"
+               "  python visualize_results.py --samples samples.txt Results/quick_search\n"
+               "\n"
+               "With --samples, the only positional argument is the results directory.",
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sample_id', nargs='?')
+    parser.add_argument('output_dir', nargs='?',
+                        help=f"directory with analysis results (default: {DEFAULT_OUTPUT_DIR})")
+    parser.add_argument('--samples', metavar='FILE',
+                        help="visualize every sample listed in FILE (one sample ID per line)")
+    parser.add_argument('--dpi', type=int, default=DEFAULT_DPI,
+                        help=f"resolution of saved figures (default: {DEFAULT_DPI})")
+    parser.add_argument('--publication', action='store_true',
+                        help=f"save publication-quality figures at {PUBLICATION_DPI} dpi")
+    parser.add_argument('--skip-procrustes', action='store_true',
+                        help="do not generate the DIAMOND vs SingleM Procrustes plot")
+    args = parser.parse_args()
+    
+    if args.samples:
+        if args.output_dir is not None:
+            parser.error("--samples takes the results directory as its only positional argument")
+        args.output_dir, args.sample_id = args.sample_id, None
+    elif args.sample_id is None:
+        parser.error("a sample ID or --samples FILE is required")
+    if args.output_dir is None:
+        args.output_dir = DEFAULT_OUTPUT_DIR
+    return args
+
+
+def read_sample_ids(samples_file):
+    """Sample IDs listed one per line; blank lines and # comments are skipped"""
+    with open(samples_file) as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+
+
+def visualize_sample(sample_id, output_dir, dpi, skip_procrustes=False, pool=None):
+    """
+    Load one sample's result tables and generate its plots
+    With a pool, the plots are rendered in parallel; otherwise one after another
+    Returns False if an input file is missing
+    """
     # Load data
     detailed_file = f"{output_dir}/{sample_id}_methane_genes_detailed.csv"
     species_file = f"{output_dir}/{sample_id}_species_abundance.csv"
@@ -307,38 +484,104 @@ def main():
     print(f"Loading data from: {output_dir}")
     
     # Load dataframes
-    if not os.path.exists(detailed_file):
-        print(f"ERROR: {detailed_file} not found")
-        sys.exit(1)
-    if not os.path.exists(species_file):
-        print(f"ERROR: {species_file} not found")
-        sys.exit(1)
-    if not os.path.exists(rpkm_file):
-        print(f"ERROR: {rpkm_file} not found")
-        sys.exit(1)
-    
-    detailed_df = pd.read_csv(detailed_file)
-    species_df = pd.read_csv(species_file)
-    rpkm_df = pd.read_csv(rpkm_file, index_col=0)
-    
-    print(f"✓ Loaded {len(detailed_df)} gene records")
+    for path in (detailed_file, species_file, rpkm_file):
+        if not os.path.exists(path):
+            print(f"ERROR: {path} not found")
+            return False
+    
+    detailed_df = pd.read_csv(detailed_file, dtype=DETAILED_DTYPES, engine=CSV_ENGINE)
+    species_df = pd.read_csv(species_file, engine=CSV_ENGINE)
+    rpkm_df = pd.read_csv(rpkm_file, index_col=0, engine=CSV_ENGINE)
+    
+    # Species tallies and read count are shared by several plots; plots get
+    # the tallies rather than detailed_df, so workers are sent small Counters
+    category_counts = _value_counter(detailed_df['gene_category'])
+    species_counts = _value_counter(detailed_df['species'])
+    n_reads = len(detailed_df)
+    
+    print(f"✓ Loaded {n_reads} gene records")
     print(f"✓ Loaded {len(species_df)} species records")
     print(f"✓ Loaded {len(rpkm_df)} gene RPKM values\n")
     
     print("Generating plots...")
     print("-" * 80)
     
-    # Generate all plots
-    plot_gene_category_contribution(detailed_df, sample_id, output_dir)
-    plot_species_contribution(species_df, detailed_df, sample_id, output_dir)
-    plot_procrustes_analysis(species_df, detailed_df, sample_id, output_dir)
-    plot_gene_rpkm_heatmap(rpkm_df, sample_id, output_dir)
+    # Decide on the Procrustes plot before rendering anything
+    procrustes_note = None
+    if skip_procrustes:
+        procrustes_note = "Skipping Procrustes analysis (--skip-procrustes)"
+    else:
+        common_species, diamond_abund, singlem_abund = match_common_species(species_df, species_counts)
+        common_fraction = len(common_species) / len(species_df) if len(species_df) else 0.0
+        if common_fraction < PROCRUSTES_MIN_COMMON_FRACTION:
+            procrustes_note = (f"⚠ Warning: Only {len(common_species)} of {len(species_df)} SingleM species "
+                               f"({common_fraction:.1%}) were also found by DIAMOND. Skipping Procrustes analysis.")
+    
+    plots = [
+        (plot_gene_category_contribution, (category_counts, n_reads, sample_id, output_dir)),
+        (plot_species_contribution, (species_df, species_counts, n_reads, sample_id, output_dir)),
+        None if procrustes_note else
+        (plot_procrustes_analysis, (common_species, diamond_abund, singlem_abund, sample_id, output_dir)),
+        (plot_gene_rpkm_heatmap, (rpkm_df, sample_id, output_dir)),
+    ]
+    
+    # Generate all plots; with a pool each runs in its own process and their
+    # output is printed in plot order once each one finishes
+    if pool is not None:
+        plots = [None if plot is None else pool.submit(_capture_output, plot[0], *plot[1], dpi=dpi)
+                 for plot in plots]
+    for plot in plots:
+        if plot is None:
+            print(procrustes_note)
+        elif pool is not None:
+            sys.stdout.write(plot.result()[1])
+        else:
+            plot[0](*plot[1], dpi=dpi)
     
     print("\n" + "="*80)
     print("VISUALIZATION COMPLETE")
     print("="*80)
     print(f"\nAll plots saved to: {output_dir}/")
     print()
+    return True
+
+
+def main():
+    args = parse_args()
+    output_dir = args.output_dir
+    dpi = PUBLICATION_DPI if args.publication else args.dpi
+    
+    # Check if output directory exists
+    if not os.path.exists(output_dir):
+        print(f"ERROR: Output directory not found: {output_dir}")
+        sys.exit(1)
+    
+    if args.sample_id is not None:
+        with ProcessPoolExecutor(max_workers=PLOT_WORKERS) as pool:
+            if not visualize_sample(args.sample_id, output_dir, dpi, args.skip_procrustes, pool):
+                sys.exit(1)
+        return
+    
+    # Batch mode: each worker imports matplotlib once and renders whole
+    # samples, plots one after another on its reused figure
+    if not os.path.exists(args.samples):
+        print(f"ERROR: Samples file not found: {args.samples}")
+        sys.exit(1)
+    sample_ids = read_sample_ids(args.samples)
+    
+    failed = []
+    with ProcessPoolExecutor(max_workers=min(BATCH_WORKERS, max(len(sample_ids), 1))) as pool:
+        results = pool.map(_capture_output, repeat(visualize_sample), sample_ids, repeat(output_dir),
+                           repeat(dpi), repeat(args.skip_procrustes))
+        for sample_id, (ok, output) in zip(sample_ids, results):
+            sys.stdout.write(output)
+            if not ok:
+                failed.append(sample_id)
+    
+    print(f"Visualized {len(sample_ids) - len(failed)} of {len(sample_ids)} samples")
+    if failed:
+        print(f"ERROR: Missing results for: {', '.join(failed)}")
+        sys.exit(1)
 
 
 if __name__ == "__main__":